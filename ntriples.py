@@ -0,0 +1,89 @@
+# Minimal N-Triples writer used by xpoJson2rdf.py
+#  * terms are formatted as N-Triples strings directly, so no rdflib objects are created while converting
+#  * rdflib is only needed for the one-off conversion of the finished xpo.nt file to Turtle
+
+from collections import defaultdict
+from functools import lru_cache
+from itertools import count
+import re
+import subprocess
+from typing import Dict, Optional
+
+# characters that must be escaped inside an N-Triples string literal
+_ESC = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+_NEEDS_ESC = re.compile('[\\\\"\n\r\t]').search
+
+def nt_uri(u: str) -> str:
+    # N-Triples form of a URI
+    return f"<{u}>"
+
+# JSON scalars other than strings become typed literals, as rdflib's Literal() would make them
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+_TRUE = f'"true"^^<{XSD}boolean>'
+_FALSE = f'"false"^^<{XSD}boolean>'
+_XSD_TYPES = {int: f'^^<{XSD}integer>', float: f'^^<{XSD}double>'}
+
+def nt_lit(v: object) -> str:
+    # N-Triples form of a literal; JSON strings, by far the common case, are plain literals
+    #  * str.translate with a dict table is slow even when nothing changes, and most values
+    #    need no escaping at all, so only translate when the C-level regex search finds something
+    if type(v) is not str:
+        if v is True:
+            return _TRUE
+        if v is False:
+            return _FALSE
+        datatype = _XSD_TYPES.get(type(v))
+        if datatype:
+            return f'"{v}"{datatype}'
+    s = str(v)
+    if _NEEDS_ESC(s):
+        s = s.translate(_ESC)
+    return f'"{s}"'
+
+# for values that repeat across many nodes (argument and constraint names, etc.) reuse the formatted string
+# (typed, since True == 1 but they are different literals)
+nt_lit_cached = lru_cache(maxsize=1<<16, typed=True)(nt_lit)
+
+# one counter per blank node prefix, so labels are unique within a run
+_counters: Dict[str, 'count[int]'] = defaultdict(count)
+_scope = ''
+
+def set_bnode_scope(scope: str) -> None:
+    # labels made after this start with scope, so that blank nodes made in
+    # separate processes can be written to the same file without clashing;
+    # the counters restart so the labels don't depend on what ran before in this process
+    global _scope
+    _scope = scope + '_' if scope else ''
+    _counters.clear()
+
+def bnode(prefix: str = '') -> str:
+    # custom BNode-like function adds a prefix to a sequence number
+    #  * every label is used exactly once, so there is nothing to gain from pooling them, and
+    #    a single f-string beats per-prefix label iterators (map(template.format, count()))
+    if prefix:
+        return f"_:{_scope}{prefix}_{next(_counters[prefix])}"
+    else:
+        return f"_:{_scope}b{next(_counters[prefix])}"
+
+def nt_to_turtle(nt_file: str, ttl_file: str, prefixes: Optional[Dict[str, str]] = None) -> None:
+    # convert an N-Triples file to Turtle, binding the given prefixes
+    #  * rapper (from the Raptor RDF utilities) does this far faster than rdflib's Turtle serializer,
+    #    so use it when it is installed and fall back to a one-shot rdflib conversion when it isn't
+    prefixes = prefixes or {}
+    cmd = ['rapper', '-q', '-i', 'ntriples', '-o', 'turtle']
+    for (prefix, ns) in prefixes.items():
+        cmd += ['-f', f'xmlns:{prefix}="{ns}"']
+    try:
+        with open(ttl_file, 'wb') as out:
+            subprocess.run(cmd + [nt_file], stdout=out, check=True)
+        return
+    except FileNotFoundError:
+        pass
+    from rdflib import Graph
+    # the graph is only parsed and serialized once, never queried, so the single-index
+    # SimpleMemory store is enough and cheaper to fill than the default triple-indexed Memory store
+    graph = Graph(store='SimpleMemory')
+    for (prefix, ns) in prefixes.items():
+        graph.bind(prefix, ns)
+    graph.parse(nt_file, format='nt')
+    graph.serialize(destination=ttl_file, format='turtle')
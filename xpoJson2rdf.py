@@ -13,52 +13,97 @@
 #  * we might want to extend this to add an addional schema statements to allow more inferences to be drawn
 
 
-from rdflib import Graph, URIRef, Namespace, BNode, Literal
-from rdflib.namespace import RDF, OWL, RDFS
-import shortuuid 
-import json
-
-def bnode(prefix = ''):
-    # custom BNode-like function adds a prefix to a short uuid sequence
-    if prefix:
-        return BNode(prefix + '_' + shortuuid.uuid()[:5])
-    else:
-        return BNode(shortuuid.uuid()[:5])
-
-
-# Create and inital RDF graph and bind some namespace prefixes in it
+from ntriples import nt_uri, nt_lit, nt_lit_cached, bnode, set_bnode_scope, nt_to_turtle
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import logging
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    # orjson is a CPython extension, so e.g. under PyPy use the standard library parser
+    from json import loads as json_loads # type: ignore[assignment]
+import ijson
 
-GRAPH = Graph()
+# Triples are written straight to xpo.nt as N-Triples lines rather than being
+# added to an in-memory rdflib Graph; the Turtle version is produced from it at the end
 
 # unsure if we should use xpo or dwd as the profix
-XPO = Namespace('http://purl.org/xpo/')
-DWD = Namespace('http://purl.org/dwd/')
+XPO_STR = 'http://purl.org/xpo/'
+DWD_STR = 'http://purl.org/dwd/'
 
 # use this namespace for the ontology
-ONT = XPO
+ONT = XPO_STR
+
+WD_STR = 'http://www.wikidata.org/wiki/'
+WDP_STR = 'http://www.wikidata.org/wiki/Property:'
+
+# URIs built in the conversion loop are formatted in one step from the raw namespace strings
+
+@lru_cache(maxsize=1<<16)
+def wd_uri(qnode: str) -> str:
+    # N-Triples form of a wikidata node; the same qnodes are referenced from many nodes
+    return f"<{WD_STR}{qnode}>"
+
+@lru_cache(maxsize=256)
+def ont_uri(name: str) -> str:
+    # N-Triples form of a term in the ontology namespace, e.g. a similarity type
+    return f"<{ONT}{name}>"
+
+# prefixes bound in the Turtle output
+PREFIXES = {'dwd': DWD_STR, 'xpo': XPO_STR,
+            'owl': 'http://www.w3.org/2002/07/owl#',
+            'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+            'rdfs': 'http://www.w3.org/2000/01/rdf-schema#',
+            'wd': WD_STR}
+
+# triples are collected in BUF and written out in batches of about BATCH_SIZE lines
+BATCH_SIZE = 10000
+BUF: List[str] = [] # cleared in place by flush, so BUF.append can be bound once
+
+def emit(s: str, p: str, o: str, append: Callable[[str], None] = BUF.append) -> None:
+    # add one triple whose terms are already in N-Triples form
+    append(f"{s} {p} {o} .\n")
+
+# problems found in the data are counted in PROBLEMS and summarised at the end of the run;
+# the details are only logged when DEBUG is set
+DEBUG = False
+PROBLEMS: Counter = Counter()
+log = logging.getLogger(__name__).debug
 
-WD = Namespace('http://www.wikidata.org/wiki/')
-WDP = Namespace('http://www.wikidata.org/wiki/Property:')
+def setup_logging() -> None:
+    # called in the main process and in each worker, since spawned workers don't inherit the configuration
+    logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO, format='%(message)s')
 
-GRAPH.bind("dwd", DWD)
-GRAPH.bind("xpo", XPO)
+def problem(kind: str, msg: str, *args: Any) -> None:
+    PROBLEMS[kind] += 1
+    log(msg, *args)
 
-GRAPH.bind("owl", OWL)
-GRAPH.bind("rdf", RDF)
-GRAPH.bind('rdfs', RDFS)
-GRAPH.bind('wd', WD)
+def flush(write: Callable[[str], None]) -> None:
+    # hand on the batch as one string; a single write of the joined batch is
+    # several times faster than out.writelines(BUF)
+    write(''.join(BUF))
+    BUF.clear()
 
 
 # Get the XPO JSON file and extract the four subsets of data
 #  * each is a dictionary where the keys are node ids and the values are dictionaries of their properties and values.
 #  * for some prperaties the value is a list -- for these with generate multiple edges, one for each value in the list.
 #  * we start by extracing the four top-level categories: events, entities, relations, and temopral_relations
+#  * by default each category is streamed from the file with ijson so the whole JSON object is never held in memory;
+#    set STREAM to False to load the file in one go (with orjson when it is installed) instead
+#  * the four categories are independent, so each is converted in its own process (WORKERS of them)
+#    and the resulting chunks of N-Triples are written to xpo.nt in order
 
-xpo_data = json.load(open('xpo.json'))
-event = xpo_data['events']
-entity = xpo_data['entities']
-relation = xpo_data['relations']
-temporal_relation = xpo_data['temporal_relations']
+STREAM = True
+WORKERS = min(4, os.cpu_count() or 1) # with 1 the categories are converted in this process
+
+XPO_TYPES = [('event', 'events'),
+             ('entity', 'entities'),
+             ('relation', 'relations'),
+             ('temporal_relation', 'temporal_relations')]
 
 # This is a list of all of the properties found in version 5.4.7
 
@@ -72,123 +117,236 @@ all_properties = ['arguments', 'comment', 'constraints', 'curated_by',
                   'temporal_relations', 'type', 'version', 'wd_description', 'wd_node', 
                   'wd_slot']
 
-def convert_generic(data, DWD=XPO, type="?", stop=0):
+# properties with a simple string value
+STRING_PROPS = frozenset(['type', 'comment', 'curated_by', 'description',
+                          'wd_node', 'name', 'wd_description', 'template',
+                          'template_curation', 'pb_roleset'])
+
+# N-Triples form of every predicate we emit, built once rather than for each triple;
+# besides the JSON properties this includes the ones used for the nested blank nodes
+PRED = {p: nt_uri(ONT + p) for p in all_properties +
+        ['description', 'overlay', 'overlay_parent', 'overlay_parent_name', 'similarNode',
+         'ldc_type', 'other_pb_roleset', 'ldc_argument', 'ldc_constraint', 'argument',
+         'constraint', 'related_qnode']}
+
+# Handlers for each structured property, looked up in HANDLERS by property name
+#  * each is called with the node's N-Triples term and the property's value
+#  * the predicates are bound as default arguments so they are fast local lookups
+
+def handle_overlay_parents(node: str, value: Any, overlay: str = PRED['overlay'],
+                           overlay_parent: str = PRED['overlay_parent'],
+                           overlay_parent_name: str = PRED['overlay_parent_name']) -> None:
+    if type(value) is list:
+        for v in value:
+            overlay_node = bnode('OVERLAY')
+            emit(node, overlay, overlay_node) 
+            #emit(overlay_node, RDF.type, nt_uri(ONT + 'overlay')) #overlay?
+            emit(overlay_node, overlay_parent, wd_uri(v['wd_node']))
+            emit(overlay_node, overlay_parent_name, nt_lit_cached(v['name']))
+    else:
+        problem('bad_overlay_parents', "Bad property-values overlay_parents %s", value)
+
+def handle_similar_nodes(node: str, value: Any, similarNode: str = PRED['similarNode'],
+                         wd_node: str = PRED['wd_node'], name: str = PRED['name'],
+                         similarity_type: str = PRED['similarity_type']) -> None:
+    if type(value) is list:
+        for v in value:
+            similar_node = bnode('SIMILAR')
+            emit(node, similarNode, similar_node) 
+            # emit(similar_node, RDF.type, nt_uri(ONT + 'similar_node'))
+            emit(similar_node, wd_node, wd_uri(v['wd_node']))
+            emit(similar_node, name, nt_lit_cached(v['name']))
+            emit(similar_node, similarity_type, ont_uri(v['similarity_type']))
+    else:
+        problem('bad_similar_nodes', "Bad property-values similar_nodes %s", value)
+
+# predicates for the string-valued properties of an LDC argument
+LDC_ARG_PREDS = {p: PRED[p] for p in ['ldc_name', 'ldc_argument_output_value', 'dwd_arg_name']}
+
+def handle_ldc_types(node: str, value: Any, ldc_type: str = PRED['ldc_type'], name: str = PRED['name'],
+                     ldc_code: str = PRED['ldc_code'], other_pb_roleset: str = PRED['other_pb_roleset'],
+                     ldc_argument: str = PRED['ldc_argument'], ldc_constraint: str = PRED['ldc_constraint'],
+                     ldc_arg_preds: Dict[str, str] = LDC_ARG_PREDS) -> None:
+    if type(value) is list:
+        # should be a list of dicts
+        for v in value:
+            ldc_type_node = bnode('LDCTYPE')
+            emit(node, ldc_type, ldc_type_node)
+            for (vname, vvalue) in v.items():
+                if vname == 'name':
+                    emit(ldc_type_node, name, nt_lit_cached(vvalue))
+                elif vname == 'ldc_code':
+                    emit(ldc_type_node, ldc_code, nt_lit_cached(vvalue))
+                elif vname == 'other_pb_rolesets':
+                    for pb_roleset in vvalue:
+                        emit(ldc_type_node, other_pb_roleset, nt_lit_cached(pb_roleset))
+                elif vname == 'ldc_arguments':
+                    for ldc_arg in vvalue:
+                        ldc_arg_node = bnode('LDCARG')
+                        emit(ldc_type_node, ldc_argument, ldc_arg_node)
+                        for (ldc_arg_name, ldc_arg_value) in ldc_arg.items():
+                            arg_pred = ldc_arg_preds.get(ldc_arg_name)
+                            if arg_pred:
+                                # all have simple string values, but dwd_arg_name can be null
+                                if ldc_arg_value is not None:
+                                    emit(ldc_arg_node, arg_pred, nt_lit_cached(ldc_arg_value))
+                            elif ldc_arg_name == "ldc_constraints":
+                                # some lists repeat an entity type; emit each one once
+                                for ent_type in dict.fromkeys(ldc_arg_value):
+                                    emit(ldc_arg_node, ldc_constraint, nt_lit_cached(ent_type))
+                            else:
+                                problem('bad_ldc_arguments_property', "Bad LDC argument property (unrecognized): %s ldc_arguments %s", node, ldc_arg_name)
+                else:
+                    problem('bad_ldc_types_property', "Bad LDC_types property (unrecognized): %s ldc_types %s", node, vname)
+    else:
+        problem('bad_ldc_types', "Bad property-values ldc_types %s (not a list)", value)
+
+def handle_arguments(node: str, value: Any, argument: str = PRED['argument'], name: str = PRED['name'],
+                     short_name: str = PRED['short_name'], constraint: str = PRED['constraint'],
+                     wd_node: str = PRED['wd_node']) -> None:
+    if type(value) is list:
+        for arg in value:
+            # an arg should have a name, short_name and constraints
+            arg_node = bnode('ARG')
+            emit(node, argument, arg_node)
+            if 'name' in arg: emit(arg_node, name, nt_lit_cached(arg['name']))
+            if 'short_name' in arg: emit(arg_node, short_name, nt_lit_cached(arg['short_name']))
+            for arg_constraint in arg['constraints']:
+                const_node = bnode('CONSTRAINT')
+                emit(arg_node, constraint, const_node)
+                emit(const_node, name, nt_lit_cached(arg_constraint['name']))
+                emit(const_node, wd_node, wd_uri(arg_constraint['wd_node']))
+    else:
+        problem('bad_arguments', "Bad property-values %s arguments %s (not a list)", node, value)
+
+def handle_related_qnodes(node: str, value: Any, related_qnode: str = PRED['related_qnode'],
+                          wd_node: str = PRED['wd_node'], name: str = PRED['name']) -> None:
+    if type(value) is list:
+        for v in value:
+            wdnode = bnode('WDNODE')
+            emit(node, related_qnode, wdnode)
+            emit(wdnode, wd_node, wd_uri(v['wd_node']))
+            emit(wdnode, name, nt_lit_cached(v['name']))
+    else:
+        #raise exception, should be a list
+        problem('bad_related_qnodes', "Bad property-values %s related_qnodes %s", node, value)
+
+def handle_unrecognized(node: str, property: str, value: Any, xpo_type: str = "?") -> None:
+    # not recognized properties...
+    pred = PRED.get(property) or nt_uri(ONT + property)
+    if type(value) is list:
+        problem('unrecognized', "Unrecognized property with list of values for type %s: %s %s", xpo_type, property, value)
+        if value == []:
+            #no values for this property, so ignore
+            pass
+        for v in value:
+            emit(node, pred, nt_lit(v))
+    else:
+        problem('unrecognized', "Unrecognized property for %s: %s %s", xpo_type, property, value)
+        emit(node, pred, nt_lit(value))
+
+HANDLERS: Dict[str, Callable[[str, Any], None]] = {'overlay_parents': handle_overlay_parents,
+            'similar_nodes': handle_similar_nodes,
+            'ldc_types': handle_ldc_types,
+            'arguments': handle_arguments,
+            'related_qnodes': handle_related_qnodes}
+
+# the simple string properties make up most of every node, so rather than going through
+# a handler they are emitted inline in convert_one using their predicate from STRING_PRED
+STRING_PRED = {p: PRED[p] for p in STRING_PROPS}
+
+def convert_one(node: str, edges: Dict[str, Any], DWD: str = XPO_STR, type: str = "?",
+                append: Callable[[str], None] = BUF.append) -> None:
+    # emit the triples for a single node and its dictionary of properties
+    node = f"<{DWD}{node}>"
+    for (property, value) in edges.items():
+        pred = STRING_PRED.get(property)
+        if pred:
+            append(f"{node} {pred} {nt_lit(value)} .\n")
+            continue
+        handler = HANDLERS.get(property)
+        if handler:
+            handler(node, value)
+        else:
+            handle_unrecognized(node, property, value, type)
+
+def convert_generic(data: Iterable[Tuple[str, Dict[str, Any]]], write: Callable[[str], None],
+                    DWD: str = XPO_STR, type: str = "?", stop: int = 0) -> int:
+    # data is an iterable of (node, edges) pairs, e.g. dict.items() or ijson.kvitems();
+    # each batch of N-Triples lines is passed to write as one string
     count = 0 # just used for testing
-    for (node, edges) in data.items():
+    for (node, edges) in data:
         count += 1
         if stop > 0 and count > stop:
             break
-        node = URIRef(DWD+node)
-        for (property, value) in edges.items():
-            if property in ['type', 'comment', 'curated_by', 'description', 
-                              'wd_node', 'name', 'wd_description', 'template', 
-                              'template_curation', 'pb_roleset']:
-                # properties with a string value
-                GRAPH.add((node, URIRef(DWD + property), Literal(value)))
-            elif property == "overlay_parents":
-                if isinstance(value, list):
-                    for v in value:
-                        overlay_node = bnode('OVERLAY')
-                        GRAPH.add((node, DWD.overlay, overlay_node)) 
-                        #GRAPH.add((overlay_node, RDF.type, DWD.overlay)) #overlay?
-                        GRAPH.add((overlay_node, DWD.overlay_parent, URIRef(WD+v['wd_node'])))
-                        GRAPH.add((overlay_node, DWD.overlay_parent_name, Literal(v['name'])))
-                else:
-                    print(f"Bad property-values {property} {value}")
-            elif property == 'similar_nodes':
-                if isinstance(value, list):
-                    for v in value:
-                        similar_node = bnode('SIMILAR')
-                        GRAPH.add((node, DWD.similarNode, similar_node)) 
-                        # GRAPH.add((similar_node, RDF.type, DWD.similar_node))
-                        GRAPH.add((similar_node, DWD.wd_node, URIRef(WD+v['wd_node'])))
-                        GRAPH.add((similar_node, DWD.name, Literal(v['name'])))
-                        GRAPH.add((similar_node, DWD.similarity_type, URIRef(DWD+v['similarity_type'])))
-                else:
-                    print(f"Bad property-values {property} {value}")
-            elif property == 'ldc_types':
-                if isinstance(value, list):
-                    # should be a list of dicts
-                    for v in value:
-                        ldc_type_node = bnode('LDCTYPE')
-                        GRAPH.add((node, DWD.ldc_type, ldc_type_node))
-                        for (vname, vvalue) in v.items():
-                            if vname == 'name':
-                                GRAPH.add((ldc_type_node, DWD.name, Literal(vvalue)))
-                            elif vname == 'ldc_code':
-                                GRAPH.add((ldc_type_node, DWD.ldc_code, Literal(vvalue)))
-                            elif vname == 'other_pb_rolesets':
-                                for pb_roleset in vvalue:
-                                    GRAPH.add((ldc_type_node, DWD.other_pb_roleset, Literal(pb_roleset)))
-                            elif vname == 'ldc_arguments':
-                                for ldc_arg in vvalue:
-                                    ldc_arg_node = bnode('LDCARG')
-                                    GRAPH.add((ldc_type_node, DWD.ldc_argument, ldc_arg_node))
-                                    for (ldc_arg_name, ldc_arg_value) in ldc_arg.items():
-                                        if ldc_arg_name in ["ldc_name", "ldc_argument_output_value","dwd_arg_name"]:
-                                            # all have simple string values
-                                            GRAPH.add((ldc_arg_node, DWD.ldc_code, Literal(ldc_arg_value)))
-                                    if ldc_arg_name == "ldc_contraints":
-                                        for ent_type in ldc_arg_value:
-                                            graph.add((ldc_arg_node, DWD.ldc_constraint, Literal(ent_type)))
-                            else:
-                                print(f"Bad LDC_types property (unrecognized): {node} {property} {vname}")
-                else:
-                    print(f"Bad property-values {property} {value} (not a list)")
-            elif property == "arguments":
-                if isinstance(value, list):
-                    for arg in value:
-                        # an arg should have a name, short_name and constraints
-                        arg_node = bnode('ARG')
-                        GRAPH.add((node, DWD.argument, arg_node))
-                        if 'name' in arg: GRAPH.add((arg_node, DWD.name, Literal(arg['name'])))
-                        if 'short_name' in arg: GRAPH.add((arg_node, DWD.short_name, Literal(arg['short_name'])))
-                        for arg_constraint in arg['constraints']:
-                            const_node = bnode('CONSTRAINT')
-                            GRAPH.add((arg_node, DWD.constraint, const_node))
-                            GRAPH.add((const_node, DWD.name, Literal(arg_constraint['name'])))
-                            GRAPH.add((const_node, DWD.wd_node, URIRef(WD + arg_constraint['wd_node'])))
-                else:
-                    print(f"Bad property-values {node} {property} {value} (not a list)")
-            elif property == "related_qnodes":
-                if isinstance(value, list):
-                    for v in value:
-                        wdnode = bnode('WDNODE')
-                        GRAPH.add((node, DWD.related_qnode, wdnode))
-                        GRAPH.add((wdnode, DWD.wd_node, URIRef(WD+v['wd_node'])))
-                        GRAPH.add((wdnode, DWD.name, Literal(v['name'])))
-                else:
-                    #raise exception, should be a list
-                    print(f"Bad property-values {node} {property} {value}")
-            # not recognized properties...
-            else:
-                if isinstance(value, list):
-                    print(f"Unrecognized property with list of values for type {type}: {property} {value}")
-                    if value == []:
-                        #no values for this property, so ignore
-                        pass
-                    for v in value:
-                        GRAPH.add((node, URIRef(DWD + property), Literal(v)))
-                else:
-                    print(f"Unrecognized property for {type}: {property} {value}")
-                    GRAPH.add((node, URIRef(DWD + property), Literal(value))) 
+        convert_one(node, edges, DWD, type)
+        if len(BUF) >= BATCH_SIZE:
+            flush(write)
+    flush(write)
     return count-1
 
-N = 0 # set to a small number for testing
+def convert_subset(xpo_type: str, key: str, data: Optional[Dict[str, Any]] = None,
+                   stop: int = 0) -> Tuple[int, List[str], Counter]:
+    # convert one of the four categories, streaming it from xpo.json unless its data is given;
+    # returns the number of nodes found, their triples as a list of N-Triples chunks and the problems found
+    #  * the chunks are the flushed batches, returned as they are so the subset isn't copied again by joining them
+    # blank node labels include the type so they don't clash with those made by other workers
+    set_bnode_scope(xpo_type)
+    PROBLEMS.clear()
+    chunks: List[str] = []
+    if data is None:
+        with open('xpo.json', 'rb') as f:
+            # use_float so numbers come out as floats, as they do from orjson/json, rather than Decimals
+            n = convert_generic(ijson.kvitems(f, key, use_float=True), chunks.append, type=xpo_type, stop=stop)
+    else:
+        n = convert_generic(data.items(), chunks.append, type=xpo_type, stop=stop)
+    return n, chunks, Counter(PROBLEMS)
 
-for (xpo_type, data) in [('event', event),
-                         ('entity', entity),
-                         ('relation', relation),
-                         ('temporal_relation', temporal_relation)]: 
-    n = convert_generic(data, type=xpo_type, stop=N)
-    print(f"Found {n} {xpo_type}")
+N = 0 # set to a small number for testing
 
-# ### Output RDF graph to xpo.ttl and xpo.nt
+def write_nt(results: Iterable[Tuple[int, List[str], Counter]]) -> Counter:
+    # write the converted subsets, in XPO_TYPES order, to xpo.nt and return the problems found;
+    # the file is written under a temporary name so a failed run doesn't leave a partial xpo.nt
+    #  * triples are not deduplicated across subsets: a node listed in two categories (e.g. DWD_P3828
+    #    is both an event and a relation) has its identical string-valued triples written twice
+    problems: Counter = Counter()
+    try:
+        with open('xpo.nt.tmp', 'w', encoding='utf-8') as out:
+            for ((xpo_type, key), (n, chunks, subset_problems)) in zip(XPO_TYPES, results):
+                out.writelines(chunks)
+                problems.update(subset_problems)
+                print(f"Found {n} {xpo_type}")
+    except BaseException:
+        os.remove('xpo.nt.tmp')
+        raise
+    os.replace('xpo.nt.tmp', 'xpo.nt')
+    return problems
 
-GRAPH.serialize(destination="xpo.ttl", format='turtle')
-GRAPH.serialize(destination="xpo.nt", format='nt')
+def main() -> None:
+    setup_logging()
+    xpo_data: Dict[str, Any] = {}
+    if not STREAM:
+        with open('xpo.json', 'rb') as f:
+            xpo_data = json_loads(f.read())
 
+    def subset_data(key: str) -> Optional[Dict[str, Any]]:
+        # streamed subsets are read from xpo.json by convert_subset itself
+        return None if STREAM else xpo_data[key]
 
+    if WORKERS > 1:
+        with ProcessPoolExecutor(WORKERS, initializer=setup_logging) as pool:
+            jobs = [pool.submit(convert_subset, xpo_type, key, subset_data(key), N)
+                    for (xpo_type, key) in XPO_TYPES]
+            problems = write_nt(job.result() for job in jobs)
+    else:
+        problems = write_nt(convert_subset(xpo_type, key, subset_data(key), N)
+                            for (xpo_type, key) in XPO_TYPES)
+    if problems:
+        print(f"Problems found (set DEBUG = True for details): {dict(problems)}")
 
+    # ### Convert xpo.nt to xpo.ttl
 
+    nt_to_turtle('xpo.nt', 'xpo.ttl', PREFIXES)
 
+if __name__ == '__main__':
+    main()